@@ -5,26 +5,146 @@ Handles user authentication, OAuth token minting, and dashboard embedding contex
 
 import os
 import time
-import json
+import types
 import base64
-import urllib.parse
-from datetime import datetime
-from flask import Flask, jsonify, request, session
+import hashlib
+import threading
+from urllib.parse import quote, quote_plus
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from flask import Flask, Response, g, jsonify, request, session
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from functools import wraps
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from flask_session import Session
+from werkzeug.middleware.proxy_fix import ProxyFix
+from functools import lru_cache, wraps
 from dotenv import load_dotenv
+import msgspec
+import redis
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Load environment variables from .env file
 load_dotenv('.env')
 
+# Databricks workspace configuration, read and validated once at startup
+_CFG = types.SimpleNamespace(
+    workspace_url=os.environ.get('DATABRICKS_WORKSPACE_URL'),
+    client_id=os.environ.get('DATABRICKS_CLIENT_ID'),
+    client_secret=os.environ.get('DATABRICKS_CLIENT_SECRET'),
+    dashboard_id=os.environ.get('DATABRICKS_DASHBOARD_ID'),
+    workspace_id=os.environ.get('DATABRICKS_WORKSPACE_ID'),
+    warehouse_id=os.environ.get('DATABRICKS_WAREHOUSE_ID')
+)
+
+# Fail fast at boot if any required value is missing or blank
+if not all([_CFG.workspace_url, _CFG.client_id, _CFG.client_secret, _CFG.dashboard_id]):
+    raise RuntimeError(
+        "Missing required Databricks configuration. "
+        "Please check your .env file has all required values: "
+        "DATABRICKS_WORKSPACE_URL, DATABRICKS_CLIENT_ID, "
+        "DATABRICKS_CLIENT_SECRET, DATABRICKS_DASHBOARD_ID"
+    )
+
+
+class MsgspecJSONProvider(DefaultJSONProvider):
+    """JSON provider that uses msgspec for faster (de)serialization"""
+    
+    def dumps(self, obj, **kwargs):
+        return msgspec.json.encode(obj, enc_hook=self.default).decode()
+    
+    def loads(self, s, **kwargs):
+        # Werkzeug only maps ValueError to a 400 (or None with silent=True)
+        try:
+            return msgspec.json.decode(s)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+
+# Typed request/response schemas, encoded and decoded directly by msgspec
+class LoginIn(msgspec.Struct):
+    username: str = ''
+
+
+class UserOut(msgspec.Struct):
+    id: str
+    name: str
+    email: str
+    department: str
+
+
+class EmbedConfig(msgspec.Struct):
+    workspace_url: str
+    workspace_id: Optional[str]
+    dashboard_id: str
+    warehouse_id: Optional[str]
+    embed_token: str
+    token_expires_at: int  # Unix timestamp, so the body is stable per token
+    user_context: UserOut
+
+
 app = Flask(__name__)
+app.json = MsgspecJSONProvider(app)
 app.secret_key = 'dev-secret-key-for-demo'  # Simple default for development
-app.config['DEBUG'] = True  # Development mode
+# Debug mode (reloader, debugger) only when explicitly enabled for local dev
+DEBUG = os.environ.get('FLASK_DEBUG') == '1'
+app.config['DEBUG'] = DEBUG
+
+# Store sessions in Redis when configured, so every Gunicorn worker and
+# instance behind a load balancer sees the same sessions. Without REDIS_URL
+# the default signed-cookie sessions are used (fine for local development).
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    app.config.update(
+        SESSION_TYPE='redis',
+        SESSION_REDIS=redis.Redis.from_url(REDIS_URL),
+        PERMANENT_SESSION_LIFETIME=3600
+    )
+    Session(app)
 
 # Enable CORS for frontend communication
 CORS(app, supports_credentials=True, origins=['http://localhost:3000'])
 
+# Behind a load balancer or reverse proxy, every request arrives from the
+# proxy's address. Trust that many X-Forwarded-For hops to recover the
+# client address (only set this when the proxies are under your control).
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+
+def _get_login_payload():
+    """
+    Decode the login body once per request.
+    
+    Shared by the rate-limit key and the login view so the body is only
+    parsed once. Returns None if the body is not a valid login payload.
+    """
+    if 'login_payload' not in g:
+        try:
+            g.login_payload = msgspec.json.decode(request.get_data(cache=False) or b'{}', type=LoginIn)
+        except msgspec.DecodeError:
+            g.login_payload = None
+    return g.login_payload
+
+
+def _login_rate_limit_key():
+    """Key for the per-(client address, username) login limit"""
+    payload = _get_login_payload()
+    return f"{get_remote_address()}:{payload.username if payload else None}"
+
+
+# Rate limiting to slow down brute-force logins (shared via Redis when configured)
+limiter = Limiter(
+    get_remote_address,
+    app=app,
+    storage_uri=REDIS_URL or 'memory://'
+)
+
 # Dummy users for demonstration (simulating row-level security)
 DUMMY_USERS = {
     'alice': {
@@ -40,24 +160,183 @@ DUMMY_USERS = {
         'department': 'Engineering'
     }
 }
+_VALID_USERNAMES = frozenset(DUMMY_USERS)
+
+# Shared HTTP session for Databricks API calls.
+# Keeps TCP/TLS connections alive across token mints instead of
+# re-handshaking with the workspace on every request.
+_DBX = requests.Session()
+_DBX.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+))
+
+# (connect, read) timeouts so a slow identity provider cannot pin a worker
+DATABRICKS_TIMEOUT = (3.05, 10)
+
+# Process-local cache of minted embed tokens, keyed by (email, department).
+# Tokens are valid for ~1 hour, so repeat dashboard loads reuse them instead
+# of repeating the 3-step OAuth flow. Bounded as an LRU to cap memory.
+# For multi-worker deployments, back this with a shared store such as Redis.
+_TOKEN_CACHE = OrderedDict()
+_TOKEN_CACHE_LOCK = threading.Lock()
+TOKEN_CACHE_MAX_ENTRIES = 1024
+TOKEN_EXPIRY_SKEW = 60  # seconds before expiry to treat a token as stale
+
+# Background refresh of cached tokens, so viewers rarely wait on a mint.
+# Only tokens used within TOKEN_REFRESH_IDLE_LIMIT are kept warm.
+_TOKEN_LAST_USED = {}
+_TOKEN_REFRESHER_STARTED = False
+TOKEN_REFRESH_INTERVAL = 30  # seconds between refresh passes
+TOKEN_REFRESH_WINDOW = 300  # refresh tokens expiring within this many seconds
+TOKEN_REFRESH_IDLE_LIMIT = 3600  # stop refreshing tokens unused for this long
+
+# Pre-encoded request pieces for token minting, built once at import.
+# Form bodies are passed as strings so requests doesn't re-encode them.
+_OIDC_HEADERS = {
+    "Content-Type": "application/x-www-form-urlencoded",
+    "Authorization": "Basic " + base64.b64encode(
+        f"{_CFG.client_id}:{_CFG.client_secret}".encode()
+    ).decode(),
+}
+_OIDC_TOKEN_URL = f"{_CFG.workspace_url}/oidc/v1/token"
+_OIDC_STEP1_BODY = "grant_type=client_credentials&scope=all-apis"
+_TOKENINFO_URL_TMPL = (
+    f"{_CFG.workspace_url}/api/2.0/lakeview/dashboards/"
+    f"{_CFG.dashboard_id}/published/tokeninfo"
+    "?external_viewer_id={viewer}&external_value={value}"
+)
+
+# Cached all-apis token for the service principal (step 1 of token minting).
+# It is not user-specific, so one token is shared by every viewer.
+_APP_TOKEN_CACHE = {}
+_APP_TOKEN_LOCK = threading.Lock()
+
+# Worker threads for re-minting several users' tokens at once
+REFRESH_MINT_WORKERS = 16
 
 
 def login_required(f):
     """Decorator to ensure user is authenticated"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if 'user' not in session:
             return jsonify({'error': 'Authentication required'}), 401
         return f(*args, **kwargs)
     return decorated_function
 
 
+def _is_token_fresh(token_data):
+    """Check whether a cached token is still valid, allowing for clock skew"""
+    expires_at = token_data['created_at'] + token_data['expires_in']
+    return expires_at - TOKEN_EXPIRY_SKEW > time.time()
+
+
+def _read_json(response, error):
+    """Parse a Databricks API response body, raising with context on failure"""
+    if response.status_code != 200:
+        raise Exception(f"{error}: {response.status_code} - {response.content[:512]!r}")
+    return msgspec.json.decode(response.content)
+
+
+def _post_json(url, *, headers, data, error):
+    """POST to the Databricks API over the shared session and parse the JSON reply"""
+    return _read_json(
+        _DBX.post(url, headers=headers, data=data, timeout=DATABRICKS_TIMEOUT),
+        error
+    )
+
+
+def _get_json(url, *, headers, error):
+    """GET from the Databricks API over the shared session and parse the JSON reply"""
+    return _read_json(
+        _DBX.get(url, headers=headers, timeout=DATABRICKS_TIMEOUT),
+        error
+    )
+
+
 def mint_databricks_token(user_data):
+    """
+    Return an OAuth token for the user, reusing a cached one when still valid.
+    
+    Tokens are cached per (email, department) so that dashboard reloads and
+    SDK token refreshes don't hit Databricks until the token nears expiry.
+    
+    Args:
+        user_data: Dictionary containing user information
+        
+    Returns:
+        Dictionary with token and expiration info
+    """
+    global _TOKEN_REFRESHER_STARTED
+    
+    key = (user_data['email'], user_data['department'])
+    
+    with _TOKEN_CACHE_LOCK:
+        token_data = _TOKEN_CACHE.get(key)
+        if token_data and _is_token_fresh(token_data):
+            _TOKEN_CACHE.move_to_end(key)
+            _TOKEN_LAST_USED[key] = time.time()
+            return token_data
+    
+    token_data = _mint_for_user(_get_app_token(), user_data)
+    
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[key] = token_data
+        _TOKEN_CACHE.move_to_end(key)
+        _TOKEN_LAST_USED[key] = time.time()
+        while len(_TOKEN_CACHE) > TOKEN_CACHE_MAX_ENTRIES:
+            evicted_key, _ = _TOKEN_CACHE.popitem(last=False)
+            _TOKEN_LAST_USED.pop(evicted_key, None)
+        
+        # Start the background refresher in the process that serves requests
+        # (i.e. after any Gunicorn fork), once there is something to refresh
+        if not _TOKEN_REFRESHER_STARTED:
+            threading.Thread(target=_token_refresher, daemon=True).start()
+            _TOKEN_REFRESHER_STARTED = True
+    
+    return token_data
+
+
+def _get_app_token():
+    """
+    Step 1 of the Databricks token flow: get the all-apis token.
+    
+    This token belongs to the service principal rather than any viewer, so it
+    is cached and shared across users until it nears expiry.
+    
+    Returns:
+        The all-apis access token string
+        
+    Raises:
+        Exception: If the request fails
+    """
+    with _APP_TOKEN_LOCK:
+        if _APP_TOKEN_CACHE and _is_token_fresh(_APP_TOKEN_CACHE):
+            return _APP_TOKEN_CACHE['access_token']
+        
+        oidc_token_data = _post_json(
+            _OIDC_TOKEN_URL,
+            headers=_OIDC_HEADERS,
+            data=_OIDC_STEP1_BODY,
+            error="Failed to get OIDC token"
+        )
+        
+        _APP_TOKEN_CACHE.update({
+            'access_token': oidc_token_data['access_token'],
+            'expires_in': oidc_token_data.get('expires_in', 3600),
+            'created_at': int(time.time())
+        })
+        return _APP_TOKEN_CACHE['access_token']
+
+
+def _mint_for_user(app_token, user_data):
     """
     Mint an OAuth token for Databricks dashboard embedding.
     
     Follows the official Databricks 3-step token generation process:
-    1. Get all-apis token from OIDC endpoint
+    1. Get all-apis token from OIDC endpoint (see _get_app_token)
     2. Get token info for the dashboard with external viewer context
     3. Generate scoped token with authorization details
     
@@ -65,94 +344,47 @@ def mint_databricks_token(user_data):
     and external_value (user attributes like department) to Databricks.
     
     Args:
+        app_token: All-apis token from step 1
         user_data: Dictionary containing user information
         
     Returns:
         Dictionary with token and expiration info
         
     Raises:
-        Exception: If required credentials are missing or token generation fails
+        Exception: If token generation fails
     """
-    
-    # Databricks workspace configuration
-    workspace_url = os.environ.get('DATABRICKS_WORKSPACE_URL')
-    client_id = os.environ.get('DATABRICKS_CLIENT_ID')
-    client_secret = os.environ.get('DATABRICKS_CLIENT_SECRET')
-    dashboard_id = os.environ.get('DATABRICKS_DASHBOARD_ID')
-    
-    # Validate required configuration
-    if not all([workspace_url, client_id, client_secret, dashboard_id]):
-        raise Exception(
-            "Missing required Databricks configuration. "
-            "Please check your .env file has all required values: "
-            "DATABRICKS_WORKSPACE_URL, DATABRICKS_CLIENT_ID, "
-            "DATABRICKS_CLIENT_SECRET, DATABRICKS_DASHBOARD_ID"
-        )
-    
-    # Create Basic Auth header
-    basic_auth = base64.b64encode(
-        f"{client_id}:{client_secret}".encode()
-    ).decode()
-    
-    # Step 1: Get all-apis token
-    oidc_response = requests.post(
-        f"{workspace_url}/oidc/v1/token",
-        headers={
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Authorization": f"Basic {basic_auth}",
-        },
-        data=urllib.parse.urlencode({
-            "grant_type": "client_credentials",
-            "scope": "all-apis"
-        })
-    )
-    
-    if oidc_response.status_code != 200:
-        raise Exception(f"Failed to get OIDC token: {oidc_response.status_code} - {oidc_response.text}")
-    
-    oidc_token = oidc_response.json()["access_token"]
-    
     # Step 2: Get token info for the dashboard with user context
     # external_viewer_id: unique user identifier for row-level security
     # external_value: user attributes (e.g., department) for filtering
-    token_info_url = (
-        f"{workspace_url}/api/2.0/lakeview/dashboards/"
-        f"{dashboard_id}/published/tokeninfo"
-        f"?external_viewer_id={urllib.parse.quote(user_data['email'])}"
-        f"&external_value={urllib.parse.quote(user_data['department'])}"
+    token_info_url = _TOKENINFO_URL_TMPL.format(
+        viewer=quote(user_data['email']),
+        value=quote(user_data['department'])
     )
     
-    token_info_response = requests.get(
+    token_info = _get_json(
         token_info_url,
-        headers={"Authorization": f"Bearer {oidc_token}"}
+        headers={"Authorization": f"Bearer {app_token}"},
+        error="Failed to get token info"
     )
     
-    if token_info_response.status_code != 200:
-        raise Exception(f"Failed to get token info: {token_info_response.status_code} - {token_info_response.text}")
-    
-    token_info = token_info_response.json()
-    
     # Step 3: Generate scoped token with authorization details
-    params = token_info.copy()
-    authorization_details = params.pop("authorization_details", None)
-    params.update({
-        "grant_type": "client_credentials",
-        "authorization_details": json.dumps(authorization_details)
-    })
-    
-    scoped_response = requests.post(
-        f"{workspace_url}/oidc/v1/token",
-        headers={
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Authorization": f"Basic {basic_auth}",
-        },
-        data=urllib.parse.urlencode(params)
+    authorization_details = token_info.pop("authorization_details", None)
+    token_info.pop("grant_type", None)
+    scoped_fields = [
+        f"{quote_plus(k)}={quote_plus(str(v))}" for k, v in token_info.items()
+    ]
+    scoped_fields.append("grant_type=client_credentials")
+    scoped_fields.append(
+        f"authorization_details={quote_plus(msgspec.json.encode(authorization_details).decode())}"
     )
+    scoped_body = "&".join(scoped_fields)
     
-    if scoped_response.status_code != 200:
-        raise Exception(f"Failed to get scoped token: {scoped_response.status_code} - {scoped_response.text}")
-    
-    scoped_token_data = scoped_response.json()
+    scoped_token_data = _post_json(
+        _OIDC_TOKEN_URL,
+        headers=_OIDC_HEADERS,
+        data=scoped_body,
+        error="Failed to get scoped token"
+    )
     
     return {
         'access_token': scoped_token_data['access_token'],
@@ -162,32 +394,83 @@ def mint_databricks_token(user_data):
     }
 
 
+def _refresh_token(key):
+    """Re-mint a cached token and swap it in, unless it was evicted meanwhile"""
+    email, department = key
+    token_data = _mint_for_user(
+        _get_app_token(),
+        {'email': email, 'department': department}
+    )
+    
+    with _TOKEN_CACHE_LOCK:
+        if key in _TOKEN_CACHE:
+            _TOKEN_CACHE[key] = token_data
+
+
+def _refresh_expiring_tokens(executor):
+    """
+    Run one refresh pass: re-mint recently used tokens that expire soon.
+    
+    Failures are logged and leave the existing cache entry in place.
+    """
+    now = time.time()
+    
+    with _TOKEN_CACHE_LOCK:
+        expiring = [
+            key for key, token_data in _TOKEN_CACHE.items()
+            if token_data['created_at'] + token_data['expires_in'] - now < TOKEN_REFRESH_WINDOW
+            and now - _TOKEN_LAST_USED.get(key, 0) < TOKEN_REFRESH_IDLE_LIMIT
+        ]
+    
+    futures = {executor.submit(_refresh_token, key): key for key in expiring}
+    for future, key in futures.items():
+        try:
+            future.result()
+        except Exception:
+            app.logger.exception("Failed to refresh token for %s", key[0])
+
+
+def _token_refresher():
+    """
+    Background loop that re-mints cached tokens shortly before they expire.
+    
+    Keeps tokens for active viewers warm so that embed-config requests are
+    served from the cache instead of waiting on the 3-step mint.
+    """
+    with ThreadPoolExecutor(max_workers=REFRESH_MINT_WORKERS) as executor:
+        while True:
+            time.sleep(TOKEN_REFRESH_INTERVAL)
+            _refresh_expiring_tokens(executor)
+
+
 @app.route('/api/auth/login', methods=['POST'])
+@limiter.limit("30/minute")
+@limiter.limit("10/minute", key_func=_login_rate_limit_key)
 def login():
     """
     Authenticate user by username only (simplified for demo).
     In production, integrate with your actual authentication system.
+    
+    Rate limits: 30/minute per client address caps brute-force and
+    credential-stuffing traffic; 10/minute per (address, username) on top.
     """
-    data = request.get_json()
-    username = data.get('username')
+    data = _get_login_payload()
+    if data is None:
+        return jsonify({'error': 'Invalid request body'}), 400
     
-    # Validate username exists
-    user = DUMMY_USERS.get(username)
-    if not user:
+    # Validate username exists before touching the session
+    username = data.username
+    if username not in _VALID_USERNAMES:
         return jsonify({'error': 'Invalid username'}), 401
     
-    # Create session
-    session['user_id'] = user['id']
-    session['username'] = username
+    # Create session (user profile is stored in the session,
+    # so authenticated requests don't need to look it up again)
+    user = DUMMY_USERS[username]
+    session['user'] = user
     
     return jsonify({
         'success': True,
-        'user': {
-            'id': user['id'],
-            'name': user['name'],
-            'email': user['email'],
-            'department': user['department']
-        }
+        'user': user
     })
 
 
@@ -202,15 +485,7 @@ def logout():
 @login_required
 def get_current_user():
     """Get currently authenticated user info"""
-    username = session.get('username')
-    user = DUMMY_USERS.get(username)
-    
-    return jsonify({
-        'id': user['id'],
-        'name': user['name'],
-        'email': user['email'],
-        'department': user['department']
-    })
+    return jsonify(session['user'])
 
 
 @app.route('/api/dashboard/embed-config', methods=['GET'])
@@ -221,53 +496,73 @@ def get_embed_config():
     
     This endpoint:
     1. Retrieves the current user from session
-    2. Mints a fresh Databricks OAuth token for that user
+    2. Mints a Databricks OAuth token for that user (or reuses a cached one)
     3. Returns dashboard configuration and token to frontend
     
     The frontend will use this information to initialize the
     Databricks embedding SDK.
     """
-    username = session.get('username')
-    user = DUMMY_USERS.get(username)
+    user = session['user']
     
-    # Mint fresh token for the current user
+    # Get a valid token for the current user (cached until near expiry)
     token_data = mint_databricks_token(user)
+    expires_at = token_data['created_at'] + token_data['expires_in']
+    
+    # The response only changes when a new token is minted, so let clients
+    # revalidate with If-None-Match instead of re-downloading the config
+    etag = hashlib.sha256(
+        msgspec.json.encode({'u': user['id'], 'exp': expires_at})
+    ).hexdigest()[:16]
+    cache_headers = {'Cache-Control': 'private, max-age=60'}
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304, headers=cache_headers)
+        response.set_etag(etag)
+        return response
     
     # Dashboard configuration
-    dashboard_config = {
-        'workspace_url': os.environ.get('DATABRICKS_WORKSPACE_URL'),
-        'workspace_id': os.environ.get('DATABRICKS_WORKSPACE_ID'),
-        'dashboard_id': os.environ.get('DATABRICKS_DASHBOARD_ID'),
-        'warehouse_id': os.environ.get('DATABRICKS_WAREHOUSE_ID'),
-        'embed_token': token_data['access_token'],
-        'token_expires_in': token_data['expires_in'],
-        'user_context': {
-            'id': user['id'],
-            'name': user['name'],
-            'email': user['email'],
-            'department': user['department']
-        }
-    }
+    dashboard_config = EmbedConfig(
+        workspace_url=_CFG.workspace_url,
+        workspace_id=_CFG.workspace_id,
+        dashboard_id=_CFG.dashboard_id,
+        warehouse_id=_CFG.warehouse_id,
+        embed_token=token_data['access_token'],
+        token_expires_at=expires_at,
+        user_context=UserOut(**user)
+    )
     
-    return jsonify(dashboard_config)
+    response = Response(msgspec.json.encode(dashboard_config), mimetype='application/json')
+    response.headers.update(cache_headers)
+    response.set_etag(etag)
+    return response
 
 
-@app.route('/api/health', methods=['GET'])
+@lru_cache(maxsize=1)
+def _utc_timestamp(epoch_seconds):
+    """Format a UTC timestamp, cached so frequent probes reuse it within a second"""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(epoch_seconds))
+
+
+@app.route('/api/health', methods=['GET', 'HEAD'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (HEAD returns an empty 200 for load balancer probes)"""
+    if request.method == 'HEAD':
+        return '', 200
+    
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat()
+        'timestamp': _utc_timestamp(int(time.time()))
     })
 
 
 if __name__ == '__main__':
-    # Run Flask development server
-    # In production, use a production WSGI server like Gunicorn
+    # Run Flask development server (local development only)
+    # In production, use Gunicorn:
+    #   gunicorn -k gevent -w $(nproc) --worker-connections 1000 app:app
     app.run(
         host='0.0.0.0',
         port=5000,
-        debug=True
+        debug=DEBUG,
+        threaded=True
     )
 
 
@@ -0,0 +1,66 @@
+"""Shared fixtures for backend tests"""
+
+import importlib
+import os
+import sys
+
+import fakeredis
+import msgspec
+import pytest
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATABRICKS_ENV = {
+    'DATABRICKS_WORKSPACE_URL': 'https://workspace.example.com',
+    'DATABRICKS_CLIENT_ID': 'client-id',
+    'DATABRICKS_CLIENT_SECRET': 'client-secret',
+    'DATABRICKS_DASHBOARD_ID': 'dashboard-id',
+    'DATABRICKS_WORKSPACE_ID': 'workspace-id',
+}
+
+
+class FakeResponse:
+    """Minimal stand-in for requests.Response"""
+
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.content = msgspec.json.encode(payload)
+
+
+class FakeDatabricks:
+    """Records calls made through the shared session and returns canned tokens"""
+
+    def __init__(self):
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        self.calls.append(('POST', url))
+        if 'scope=all-apis' in kwargs['data']:
+            return FakeResponse({'access_token': 'app-token', 'expires_in': 3600})
+        return FakeResponse({'access_token': f'scoped-token-{len(self.calls)}', 'expires_in': 3600})
+
+    def get(self, url, **kwargs):
+        self.calls.append(('GET', url))
+        return FakeResponse({'authorization_details': [], 'scope': 'dashboards'})
+
+
+@pytest.fixture
+def load_app(monkeypatch):
+    """Import a fresh copy of app.py with the given environment overrides (None unsets)"""
+    def _load(**env):
+        for key, value in {**DATABRICKS_ENV, **env}.items():
+            if value is None:
+                monkeypatch.delenv(key, raising=False)
+            else:
+                monkeypatch.setenv(key, value)
+        monkeypatch.setattr(redis.Redis, 'from_url', lambda url: fakeredis.FakeRedis())
+        sys.modules.pop('app', None)
+        module = importlib.import_module('app')
+        databricks = FakeDatabricks()
+        monkeypatch.setattr(module._DBX, 'post', databricks.post)
+        monkeypatch.setattr(module._DBX, 'get', databricks.get)
+        module.databricks = databricks
+        return module
+    yield _load
+    sys.modules.pop('app', None)
@@ -0,0 +1,224 @@
+"""Tests for the Flask backend"""
+
+import json
+from urllib.parse import parse_qs, urlencode
+
+import pytest
+
+from conftest import FakeResponse
+
+
+def test_redis_session_round_trip(load_app):
+    app = load_app(REDIS_URL='redis://localhost:6379/0')
+    client = app.app.test_client()
+
+    response = client.post('/api/auth/login', json={'username': 'alice'})
+    assert response.status_code == 200
+
+    response = client.get('/api/auth/current-user')
+    assert response.status_code == 200
+    assert response.get_json() == app.DUMMY_USERS['alice']
+
+
+@pytest.mark.parametrize('value', [None, ''])
+def test_missing_or_blank_config_fails_at_import(load_app, value):
+    with pytest.raises(RuntimeError, match='Missing required Databricks configuration'):
+        load_app(DATABRICKS_WORKSPACE_URL=value)
+
+
+def test_embed_config_etag_matches_stable_body(load_app, monkeypatch):
+    app = load_app()
+    client = app.app.test_client()
+    client.post('/api/auth/login', json={'username': 'alice'})
+    now = app.time.time()
+
+    response = client.get('/api/dashboard/embed-config')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    expires_at = response.get_json()['token_expires_at']
+
+    # Same token later on: the cached body is still accurate, so 304 is correct
+    monkeypatch.setattr(app.time, 'time', lambda: now + 3000)
+    response = client.get('/api/dashboard/embed-config', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+    # Token re-minted near expiry: the body changes, so the ETag must too
+    monkeypatch.setattr(app.time, 'time', lambda: now + 3580)
+    response = client.get('/api/dashboard/embed-config', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['token_expires_at'] > expires_at
+
+
+def test_login_rate_limit_is_per_client_and_username(load_app):
+    app = load_app()
+    client = app.app.test_client()
+
+    for _ in range(10):
+        assert client.post('/api/auth/login', json={'username': 'alice'}).status_code == 200
+    assert client.post('/api/auth/login', json={'username': 'alice'}).status_code == 429
+
+    # Switching user from the same address is not blocked by alice's limit
+    assert client.post('/api/auth/login', json={'username': 'bob'}).status_code == 200
+
+
+def test_login_rate_limit_caps_each_address_across_usernames(load_app):
+    app = load_app()
+    client = app.app.test_client()
+
+    statuses = [
+        client.post('/api/auth/login', json={'username': f'guess{i}'}).status_code
+        for i in range(31)
+    ]
+    assert statuses[:30] == [401] * 30
+    assert statuses[30] == 429
+
+
+def test_login_rate_limit_uses_forwarded_client_address(load_app):
+    app = load_app(TRUSTED_PROXY_HOPS='1')
+    client = app.app.test_client()
+
+    for _ in range(10):
+        client.post('/api/auth/login', json={'username': 'alice'},
+                    headers={'X-Forwarded-For': '203.0.113.1'})
+    response = client.post('/api/auth/login', json={'username': 'alice'},
+                           headers={'X-Forwarded-For': '203.0.113.1'})
+    assert response.status_code == 429
+
+    response = client.post('/api/auth/login', json={'username': 'alice'},
+                           headers={'X-Forwarded-For': '203.0.113.2'})
+    assert response.status_code == 200
+
+
+def test_token_refresher_starts_on_first_cache_insert(load_app, monkeypatch):
+    app = load_app()
+    started = []
+    monkeypatch.setattr(app.threading.Thread, 'start', lambda thread: started.append(thread))
+    assert not app._TOKEN_REFRESHER_STARTED
+
+    app.mint_databricks_token(app.DUMMY_USERS['alice'])
+    app.mint_databricks_token(app.DUMMY_USERS['bob'])
+
+    assert len(started) == 1
+    assert app._TOKEN_REFRESHER_STARTED
+
+
+def test_failed_mint_does_not_track_last_used(load_app, monkeypatch):
+    app = load_app()
+
+    def fail(*args, **kwargs):
+        raise Exception("Failed to get token info")
+    monkeypatch.setattr(app, '_mint_for_user', fail)
+
+    with pytest.raises(Exception):
+        app.mint_databricks_token(app.DUMMY_USERS['alice'])
+    assert app._TOKEN_LAST_USED == {}
+    assert not app._TOKEN_REFRESHER_STARTED
+
+
+def test_scoped_token_body_matches_urlencode(load_app, monkeypatch):
+    app = load_app()
+    token_info = {
+        'authorization_details': [{'type': 'workspace_permission', 'object_path': '/dashboards/é'}],
+        'custom claim': 'a&b=c',
+        'scope': 'dashboards sql',
+        'grant_type': 'should-be-replaced',
+    }
+    monkeypatch.setattr(app._DBX, 'get', lambda url, **kwargs: FakeResponse(dict(token_info)))
+    sent = []
+
+    def post(url, **kwargs):
+        sent.append(kwargs['data'])
+        return FakeResponse({'access_token': 'scoped-token', 'expires_in': 3600})
+    monkeypatch.setattr(app._DBX, 'post', post)
+
+    app._mint_for_user('app-token', app.DUMMY_USERS['alice'])
+
+    # What the original params.update(...) + urlencode(...) flow produced
+    params = dict(token_info)
+    authorization_details = params.pop('authorization_details')
+    params.update({
+        'grant_type': 'client_credentials',
+        'authorization_details': json.dumps(authorization_details, separators=(',', ':'), ensure_ascii=False)
+    })
+    assert parse_qs(sent[0]) == parse_qs(urlencode(params))
+
+
+def test_malformed_json_body_returns_400(load_app):
+    app = load_app()
+    client = app.app.test_client()
+
+    response = client.post('/api/auth/login', data='not json', content_type='application/json')
+    assert response.status_code == 400
+
+    with app.app.test_request_context(data='not json', content_type='application/json'):
+        assert app.request.get_json(silent=True) is None
+
+
+@pytest.fixture
+def refresh_app(load_app, monkeypatch):
+    """App with two cached tokens (alice expiring soon, bob fresh) and no refresher thread"""
+    app = load_app()
+    monkeypatch.setattr(app, '_TOKEN_REFRESHER_STARTED', True)
+    app.mint_databricks_token(app.DUMMY_USERS['alice'])
+    app.mint_databricks_token(app.DUMMY_USERS['bob'])
+    alice_key = ('alice@example.com', 'Sales')
+    app._TOKEN_CACHE[alice_key]['created_at'] -= 3400
+    app.alice_key = alice_key
+    app.bob_key = ('bob@example.com', 'Engineering')
+    return app
+
+
+def _refresh_once(app):
+    with app.ThreadPoolExecutor(max_workers=2) as executor:
+        app._refresh_expiring_tokens(executor)
+
+
+def test_refresh_only_replaces_tokens_near_expiry(refresh_app):
+    app = refresh_app
+    old_alice = app._TOKEN_CACHE[app.alice_key]
+    old_bob = app._TOKEN_CACHE[app.bob_key]
+
+    _refresh_once(app)
+
+    assert app._TOKEN_CACHE[app.alice_key] is not old_alice
+    assert app._TOKEN_CACHE[app.alice_key]['access_token'] != old_alice['access_token']
+    assert app._TOKEN_CACHE[app.bob_key] is old_bob
+
+
+def test_refresh_skips_idle_users(refresh_app):
+    app = refresh_app
+    app._TOKEN_LAST_USED[app.alice_key] -= app.TOKEN_REFRESH_IDLE_LIMIT + 1
+    old_alice = app._TOKEN_CACHE[app.alice_key]
+
+    _refresh_once(app)
+
+    assert app._TOKEN_CACHE[app.alice_key] is old_alice
+
+
+def test_refresh_does_not_readd_evicted_entry(refresh_app, monkeypatch):
+    app = refresh_app
+    mint_for_user = app._mint_for_user
+
+    def evict_during_mint(app_token, user_data):
+        app._TOKEN_CACHE.pop(app.alice_key)
+        return mint_for_user(app_token, user_data)
+    monkeypatch.setattr(app, '_mint_for_user', evict_during_mint)
+
+    _refresh_once(app)
+
+    assert app.alice_key not in app._TOKEN_CACHE
+
+
+def test_refresh_keeps_old_entry_when_mint_fails(refresh_app, monkeypatch):
+    app = refresh_app
+    old_alice = app._TOKEN_CACHE[app.alice_key]
+
+    def fail(*args, **kwargs):
+        raise Exception("Failed to get scoped token")
+    monkeypatch.setattr(app, '_mint_for_user', fail)
+
+    _refresh_once(app)
+
+    assert app._TOKEN_CACHE[app.alice_key] is old_alice